@@ -51,10 +51,14 @@ app.use((req, res, next) => {
   }
 });
 
-app.post('/queue/receive', (req, res) => {
-  const { queueName, maxMessages = 1 } = req.body;
-  console.log(`[Queue API] Receiving messages from ${queueName}, maxMessages: ${maxMessages}`);
-  const messages = queueService.getMessages(queueName, maxMessages);
+app.post('/queue/receive', async (req, res) => {
+  const { queueName, maxMessages = 1, waitTimeSeconds = 0 } = req.body;
+  console.log(`[Queue API] Receiving messages from ${queueName}, maxMessages: ${maxMessages}, waitTimeSeconds: ${waitTimeSeconds}`);
+  // Stop waiting if the client goes away so no messages are handed to a closed socket
+  const controller = new AbortController();
+  res.on('close', () => controller.abort());
+  const waitMs = Math.min(Number(waitTimeSeconds) || 0, 20) * 1000;
+  const messages = await queueService.waitForMessages(queueName, maxMessages, waitMs, controller.signal);
   console.log(`[Queue API] Returning ${messages.length} message(s)`);
   if (messages.length > 0) {
     console.log(`[Queue API] Message details:`, {
@@ -5,6 +5,7 @@ class QueueService {
     this.queues = new Map();
     this.listeners = new Map();
     this.pendingMessages = new Map(); // Track pending messages per queue
+    this.waiters = new Map(); // Long-poll receivers waiting for a message
   }
 
   sendMessage(queueName, message) {
@@ -24,6 +25,12 @@ class QueueService {
     const queue = this.queues.get(queueName);
     queue.push(messageWithMetadata);
 
+    // Hand the message to the oldest long-poll receiver, if any
+    const waiter = (this.waiters.get(queueName) || [])[0];
+    if (waiter) {
+      waiter();
+    }
+
     console.log(`[Queue] Message sent to ${queueName}:`, {
       messageId: messageWithMetadata.MessageId,
       hasTrace: !!message.sentryTrace,
@@ -83,6 +90,43 @@ class QueueService {
     const queue = this.queues.get(queueName) || [];
     return queue.splice(0, maxMessages);
   }
+
+  // Long-poll variant of getMessages: resolves as soon as messages are available,
+  // or with an empty list after waitMs / when signal is aborted
+  waitForMessages(queueName, maxMessages = 1, waitMs = 0, signal) {
+    const messages = this.getMessages(queueName, maxMessages);
+    if (messages.length > 0 || waitMs <= 0 || signal?.aborted) {
+      return Promise.resolve(messages);
+    }
+
+    if (!this.waiters.has(queueName)) {
+      this.waiters.set(queueName, []);
+    }
+    const waiters = this.waiters.get(queueName);
+
+    return new Promise((resolve) => {
+      const cleanup = () => {
+        clearTimeout(timer);
+        signal?.removeEventListener('abort', onTimeout);
+        const index = waiters.indexOf(waiter);
+        if (index !== -1) {
+          waiters.splice(index, 1);
+        }
+      };
+      const waiter = () => {
+        cleanup();
+        resolve(this.getMessages(queueName, maxMessages));
+      };
+      const onTimeout = () => {
+        cleanup();
+        resolve([]);
+      };
+
+      const timer = setTimeout(onTimeout, waitMs);
+      signal?.addEventListener('abort', onTimeout);
+      waiters.push(waiter);
+    });
+  }
 }
 
 export const queueService = new QueueService();
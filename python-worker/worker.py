@@ -1,88 +1,247 @@
 #!/usr/bin/env python3
+import logging
 import os
+import re
+import signal
+import sys
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import requests
 import sentry_sdk
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from sentry_sdk.integrations.atexit import AtexitIntegration
+from sentry_sdk.integrations.excepthook import ExcepthookIntegration
 from sentry_sdk.integrations.logging import LoggingIntegration
 from dotenv import load_dotenv
 
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    import json
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj).encode()
+
 load_dotenv()
-print(f"[Python Worker] DSN loaded: {'YES' if os.getenv('SENTRY_DSN') else 'NO'}")
 
-def before_send(event, hint):
-    event_type = event.get('type')
-    if event_type == 'transaction' or 'transaction' in event or 'spans' in event:
-        if 'sampled' not in event or event.get('sampled') is not True:
-            event['sampled'] = True
-    return event
+logger = logging.getLogger(__name__)
+_handler = logging.StreamHandler()
+_handler.setFormatter(logging.Formatter('[Python Worker] %(message)s'))
+logger.addHandler(_handler)
+logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+TRACING_ENABLED = bool(os.getenv('SENTRY_DSN'))
+logger.info("DSN loaded: %s", 'YES' if TRACING_ENABLED else 'NO')
+
+TRACES_SAMPLE_RATE = float(os.getenv('TRACES_SAMPLE_RATE', '0.1'))
+
+def traces_sampler(sampling_context):
+    # Follow the producer's decision so distributed traces stay complete
+    parent_sampled = sampling_context.get('parent_sampled')
+    if parent_sampled is not None:
+        return float(parent_sampled)
+    return TRACES_SAMPLE_RATE
 
 sentry_sdk.init(
     dsn=os.getenv("SENTRY_DSN"),
-    traces_sample_rate=1.0,
+    traces_sampler=traces_sampler,
     environment="development",
-    debug=True,
+    max_breadcrumbs=10,
+    attach_stacktrace=False,
+    include_local_variables=False,
+    send_default_pii=False,
+    auto_enabling_integrations=False,
+    default_integrations=False,
     integrations=[
-        LoggingIntegration(level=None, event_level=None),
+        AtexitIntegration(),
+        ExcepthookIntegration(),
+        LoggingIntegration(level=logging.WARNING, event_level=None),
     ],
-    before_send=before_send,
 )
 
-def process_message(message):
-    sentry_trace = message.get('sentryTrace')
-    baggage = message.get('baggage')
-    
-    if sentry_trace:
-        headers = {'sentry-trace': sentry_trace}
-        if baggage:
-            headers['baggage'] = baggage
-        
-        try:
-            trace_envelope = sentry_sdk.continue_trace(headers)
-            transaction = sentry_sdk.start_transaction(trace_envelope)
-            
-            with transaction:
-                with sentry_sdk.start_span(
+WORK_SECONDS = 0.5
+
+_TRACE_RE = re.compile(r"^[ \t]*([0-9a-f]{32})-([0-9a-f]{16})(?:-([01]))?[ \t]*$")
+
+_warned_no_trace = False
+_warned_no_trace_lock = threading.Lock()
+
+def trace_headers(sentry_trace, baggage):
+    if not sentry_trace:
+        return None
+
+    if logger.isEnabledFor(logging.DEBUG):
+        trace_match = _TRACE_RE.match(sentry_trace)
+        if trace_match:
+            logger.debug("Continuing trace %s from span %s", *trace_match.group(1, 2))
+        else:
+            logger.debug("Unparseable sentry-trace %r; continue_trace will start a new trace", sentry_trace)
+    return {'sentry-trace': sentry_trace, 'baggage': baggage} if baggage else {'sentry-trace': sentry_trace}
+
+def process_message(message, headers, parent=None):
+    global _warned_no_trace
+
+    if headers and not TRACING_ENABLED:
+        time.sleep(WORK_SECONDS)
+        return {'success': True, 'processedBy': 'python-worker', 'processedAt': time.time()}
+
+    if headers:
+        msg_id = message.get('MessageId')
+        task_type = message.get('taskType', 'unknown')
+        with sentry_sdk.isolation_scope():
+            try:
+                trace_envelope = sentry_sdk.continue_trace(
+                    headers,
                     op='queue.process',
-                    description='python-worker-processing'
-                ) as span:
-                    time.sleep(0.5)
-                    span.set_tag('task.type', message.get('taskType', 'unknown'))
+                    name='python-worker-processing'
+                )
+                if parent is not None:
+                    span = parent.start_child(op='queue.process', name=msg_id)
+                else:
+                    span = sentry_sdk.start_transaction(trace_envelope)
+
+                with span:
+                    time.sleep(WORK_SECONDS)
+                    span.set_tag('task.type', task_type)
                     span.set_status('ok')
-            
-            return {'success': True, 'processedBy': 'python-worker'}
-        except Exception as e:
-            print(f"[Python Worker] Error: {e}")
-            sentry_sdk.capture_exception(e)
-            return {'success': False, 'error': str(e)}
+                    processed_at = time.time()
+
+                return {'success': True, 'processedBy': 'python-worker', 'processedAt': processed_at}
+            except Exception as e:
+                logger.error("Error: %s", e)
+                sentry_sdk.capture_exception(e)
+                return {'success': False, 'error': str(e)}
     else:
-        print("[Python Worker] No trace context")
+        with _warned_no_trace_lock:
+            first = not _warned_no_trace
+            _warned_no_trace = True
+        if first:
+            logger.warning("No trace context; skipping messages without sentryTrace")
+        else:
+            logger.debug("No trace context for %s", message.get('MessageId'))
         return {'success': False, 'error': 'No trace context'}
 
 QUEUE_API_URL = os.getenv('QUEUE_API_URL', 'http://localhost:3002')
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', '32'))
+WAIT_TIME_SECONDS = max(1, int(os.getenv('WAIT_TIME_SECONDS', '20')))
+MAX_BACKOFF_SECONDS = 30
+
+WORKERS = int(os.getenv('WORKERS', '8'))
+
+_RECEIVE_URL = f'{QUEUE_API_URL}/queue/receive'
+# Indexed by the number of free worker slots, so the worker never holds more
+# received messages than it can run at once
+_POLL_BODIES = [
+    json_dumps({
+        'queueName': 'python-worker-queue',
+        'maxMessages': size,
+        'waitTimeSeconds': WAIT_TIME_SECONDS,
+    })
+    for size in range(min(BATCH_SIZE, WORKERS) + 1)
+]
+
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=Retry(total=2, backoff_factor=0.1))
+session.mount('http://', _adapter)
+session.mount('https://', _adapter)
+session.headers['Content-Type'] = 'application/json'
 
-print(f"[Python Worker] Starting worker, polling {QUEUE_API_URL}")
+EXECUTOR = ThreadPoolExecutor(max_workers=WORKERS)
 
-while True:
+def on_processed(future):
     try:
-        response = requests.post(
-            f'{QUEUE_API_URL}/queue/receive',
-            json={'queueName': 'python-worker-queue', 'maxMessages': 1},
-            timeout=5
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            messages = data.get('messages', [])
-            
-            for message in messages:
-                try:
-                    result = process_message(message)
-                    print(f"[Python Worker] Processed: {result}")
-                except Exception as e:
-                    print(f"[Python Worker] Error processing message: {e}")
-                    sentry_sdk.capture_exception(e)
-        
-        time.sleep(1)
+        result = future.result()
+        logger.debug("Processed: %s", result)
     except Exception as e:
-        print(f"[Python Worker] Polling error: {e}")
-        time.sleep(5)
+        logger.error("Error processing message: %s", e)
+        if TRACING_ENABLED:
+            sentry_sdk.capture_exception(e)
+
+def start_batch_transaction(headers, size):
+    with sentry_sdk.isolation_scope():
+        trace_envelope = sentry_sdk.continue_trace(
+            headers,
+            op='queue.process_batch',
+            name=f'batch[{size}]'
+        )
+        return sentry_sdk.start_transaction(trace_envelope)
+
+def finish_when_done(transaction, futures):
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        failed = any(f.exception() is not None or not f.result().get('success') for f in futures)
+        transaction.set_status('internal_error' if failed else 'ok')
+        transaction.finish()
+
+    for future in futures:
+        future.add_done_callback(on_done)
+
+def main():
+    logger.info("Starting worker, polling %s", QUEUE_API_URL)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    pending = set()
+    backoff = 1
+    try:
+        while True:
+            try:
+                pending = {f for f in pending if not f.done()}
+                while len(pending) >= WORKERS:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                poll_started = time.monotonic()
+                response = session.post(
+                    _RECEIVE_URL,
+                    data=_POLL_BODIES[min(BATCH_SIZE, WORKERS - len(pending))],
+                    timeout=WAIT_TIME_SECONDS + 5
+                )
+
+                response.raise_for_status()
+                data = json_loads(response.content)
+                messages = data.get('messages', [])
+
+                # An empty reply well before the requested wait means the queue API
+                # is not long-polling; pause so the loop doesn't spin
+                if not messages and time.monotonic() - poll_started < 1:
+                    time.sleep(1)
+
+                groups = {}
+                for m in messages:
+                    groups.setdefault((m.get('sentryTrace'), m.get('baggage')), []).append(m)
+
+                for key, group in groups.items():
+                    headers = trace_headers(*key)
+                    parent = None
+                    if TRACING_ENABLED and headers and len(group) > 1:
+                        parent = start_batch_transaction(headers, len(group))
+
+                    futures = [EXECUTOR.submit(process_message, m, headers, parent) for m in group]
+                    for future in futures:
+                        future.add_done_callback(on_processed)
+                    pending.update(futures)
+                    if parent is not None:
+                        finish_when_done(parent, futures)
+
+                backoff = 1
+            except Exception as e:
+                logger.error("Polling error: %s", e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+    finally:
+        EXECUTOR.shutdown(wait=True)
+        session.close()
+        sentry_sdk.flush(timeout=5.0)
+
+if __name__ == '__main__':
+    main()